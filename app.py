@@ -1,7 +1,13 @@
 # Streamlit Chess Game with Extremely Difficult AI (using Stockfish)
 # To run: streamlit run app.py
-# Requirements: pip install streamlit chess stockfish
+# Requirements: pip install streamlit chess "stockfish>=4.0.4,<6"
+# (before 4.0.4 the stockfish wrapper's set_fen_position sends ucinewgame on every move)
 # Download Stockfish binary from https://stockfishchess.org/download/ and set the path below.
+# Optional: download Syzygy endgame tablebases (e.g. 3-4-5 man from https://tablebase.lichess.ovh/tables/standard/)
+# and set SYZYGY_PATH so endgames are answered from the tables instead of searched.
+
+import string
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
 import chess
@@ -10,24 +16,162 @@ from stockfish import Stockfish
 
 # Set the path to your Stockfish binary
 STOCKFISH_PATH = "path/to/your/stockfish/binary"  # Update this!
+SYZYGY_PATH = ""  # Directory with Syzygy tablebases; leave empty to disable (Stockfish silently ignores a wrong path)
+AI_MOVE_TIME_MS = 2000  # Search time per AI move; bounds latency whatever the position
 
-# Initialize Stockfish
-@st.cache_resource
+# Square names indexed by square, so hot loops index a tuple instead of calling chess.square_name
+_SQ_NAMES = tuple(chess.SQUARE_NAMES)
+
+# Initialize Stockfish (no spinner: it is first used from the AI worker thread)
+@st.cache_resource(show_spinner=False)
 def get_stockfish():
-    return Stockfish(path=STOCKFISH_PATH, depth=18, parameters={"Threads": 4, "Hash": 2048})  # High depth for difficulty
+    # One position is searched at a time, so a single thread avoids lazy-SMP overhead
+    stockfish = Stockfish(path=STOCKFISH_PATH, parameters={"Threads": 1, "Hash": 2048})
+    if SYZYGY_PATH:
+        # The wrapper validates parameters= and _set_option against its own option list, which
+        # lacks SyzygyPath, so send the raw UCI line (_put syncs with isready before the next command).
+        # _put is private; the <6 pin in the requirements keeps it to wrapper releases checked to support this.
+        stockfish._put(f"setoption name SyzygyPath value {SYZYGY_PATH}")
+    # No shutdown hook: the wrapper's __del__ sends quit once the cache drops this engine
+    return stockfish
+
+# Best engine move for a position, memoized by FEN so reruns and undo/redo don't search again.
+# set_fen_position doesn't send ucinewgame, so the transposition table survives between moves.
+@st.cache_data(max_entries=512, show_spinner=False)
+def _best_move(fen):
+    stockfish = get_stockfish()
+    stockfish.set_fen_position(fen)
+    return stockfish.get_best_move_time(AI_MOVE_TIME_MS)
+
+# Background AI task. A new game clears the engine's hash here, outside the cache,
+# so it happens even when the first position of the game is already cached.
+def _ai_move_task(fen, new_game):
+    if new_game:
+        get_stockfish().send_ucinewgame_command()
+    return _best_move(fen)
+
+# Single worker shared by all sessions: there is one engine process, so searches run one at a time
+@st.cache_resource
+def get_ai_executor():
+    return ThreadPoolExecutor(max_workers=1)
+
+# Static wrapper around the board SVG, compiled once at import instead of re-formatting an f-string per rerun
+_BOARD_HTML_TEMPLATE = string.Template("""
+        <div style="display: flex; justify-content: center; align-items: center; padding: 10px;">
+            $svg
+        </div>
+        """)
+
+# Board HTML (wrapped SVG) for a piece placement, cached so reruns that don't move a piece skip rendering.
+# Keyed on the placement only: turn, castling and move counters don't change the picture.
+@st.cache_data(max_entries=256)
+def _board_html(board_fen, size=500, lastmove_uci=None):
+    lastmove = chess.Move.from_uci(lastmove_uci) if lastmove_uci else None
+    svg = chess.svg.board(board=chess.BaseBoard(board_fen), size=size, lastmove=lastmove)
+    return _BOARD_HTML_TEMPLATE.substitute(svg=svg)
 
 # Function to display the board
 def display_board(board):
     # Responsive board size based on container
-    svg = chess.svg.board(board=board, size=500)
-    st.markdown(
-        f"""
-        <div style="display: flex; justify-content: center; align-items: center; padding: 10px;">
-            {svg}
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
+    lastmove_uci = board.peek().uci() if board.move_stack else None
+    st.markdown(_board_html(board.board_fen(), 500, lastmove_uci), unsafe_allow_html=True)
+
+# Result of a finished position ("1-0", "0-1", "1/2-1/2") or None, cached by FEN since Streamlit
+# reruns the script on every interaction. outcome() checks every termination in one pass.
+@st.cache_data(max_entries=256)
+def _game_status(fen):
+    outcome = chess.Board(fen).outcome()
+    return outcome.result() if outcome else None
+
+# Legal target squares grouped by origin square, built in one pass and cached by FEN
+@st.cache_data(max_entries=256)
+def _build_legal_moves_dict(fen):
+    # Local aliases turn the per-move global/attribute lookups into fast local loads
+    sq_names, queen = _SQ_NAMES, chess.QUEEN
+    legal_moves_dict = {}
+    for move in chess.Board(fen).legal_moves:
+        if move.promotion and move.promotion != queen:
+            continue  # List each promotion square once
+        legal_moves_dict.setdefault(sq_names[move.from_square], []).append(sq_names[move.to_square])
+    return legal_moves_dict
+
+# Start a fresh game in this session
+def reset_game():
+    st.session_state.board = chess.Board()
+    st.session_state.player_turn = True
+    st.session_state.move_count = 0
+    st.session_state.history = []
+    # Only a new game clears the engine's hash; moves within a game keep reusing it
+    st.session_state.new_engine_game = True
+    # Don't carry an AI result over from the previous game, so the next AI turn submits a task
+    st.session_state.ai_fen = None
+
+# Parse and legality-check a UCI move in one step; a bare pawn move onto the last rank promotes to a queen
+def parse_move(board, uci):
+    try:
+        move = board.parse_uci(uci)
+    except chess.IllegalMoveError:
+        if len(uci) != 4:
+            raise
+        move = board.parse_uci(uci + "q")
+    if not move:
+        # parse_uci lets the null move "0000" through
+        raise chess.IllegalMoveError(f"null move not allowed: {uci!r}")
+    return move
+
+# Push a move and extend the formatted history ("N. white black" lines) instead of rebuilding it every rerun
+def push_move(board, move):
+    # Index square names directly; only promotions need move.uci() for the piece suffix
+    uci = move.uci() if move.promotion else _SQ_NAMES[move.from_square] + _SQ_NAMES[move.to_square]
+    history = st.session_state.history
+    if board.turn == chess.WHITE:
+        history.append(f"{board.fullmove_number}. {uci}")
+    else:
+        history[-1] = f"{history[-1]} {uci}"
+    board.push(move)
+
+# Take back the last move and trim the formatted history to match
+def pop_move(board):
+    board.pop()
+    history = st.session_state.history
+    if board.turn == chess.WHITE:
+        history.pop()
+    else:
+        history[-1] = history[-1].rsplit(" ", 1)[0]
+
+# AI turn: search in the background so Undo/Reset stay responsive while the engine thinks.
+# Only this fragment reruns while polling; the whole page reruns once the move has been pushed.
+@st.fragment(run_every=0.2)
+def ai_move_fragment():
+    board = st.session_state.board
+    fen = board.fen()
+    if st.session_state.get("ai_fen") != fen:
+        st.session_state.ai_future = get_ai_executor().submit(_ai_move_task, fen, st.session_state.pop("new_engine_game", False))
+        st.session_state.ai_fen = fen
+    ai_future = st.session_state.ai_future
+    if ai_future is None:
+        st.error(st.session_state.ai_error)
+        return
+    if not ai_future.done():
+        st.info("🤖 AI is thinking...")
+        return
+    try:
+        best_move = ai_future.result()
+    except Exception as e:
+        # Keep the failure instead of re-raising it on every poll; Undo/Reset are still drawn
+        st.session_state.ai_future = None
+        st.session_state.ai_error = f"❌ AI engine error: {e}"
+        st.error(st.session_state.ai_error)
+        return
+    if best_move:
+        try:
+            move = board.parse_uci(best_move)
+        except ValueError:
+            st.error("Invalid AI move!")
+        else:
+            push_move(board, move)
+            st.session_state.board = board
+            st.rerun()
 
 # Main app
 st.title("Chess Game on Streamlit")
@@ -40,6 +184,8 @@ if 'player_turn' not in st.session_state:
     st.session_state.player_turn = True  # True for White
 if 'move_count' not in st.session_state:
     st.session_state.move_count = 0
+if 'history' not in st.session_state:
+    st.session_state.history = []
 
 # Handle Four-Player Chess mode
 if game_mode == "Four-Player Chess (Experimental)":
@@ -99,9 +245,13 @@ if game_mode == "Four-Player Chess (Experimental)":
 board = st.session_state.board
 display_board(board)
 
-if board.is_game_over():
+result = _game_status(board.fen())
+if result is None and board.is_fivefold_repetition():
+    # Repetitions depend on the move stack, which a FEN does not carry
+    result = "1/2-1/2"
+
+if result is not None:
     st.write("Game Over!")
-    result = board.result()
     if result == "1-0":
         st.success("🏆 White wins!")
     elif result == "0-1":
@@ -109,9 +259,7 @@ if board.is_game_over():
     else:
         st.info("🤝 It's a draw!")
     if st.button("Reset Game"):
-        st.session_state.board = chess.Board()
-        st.session_state.player_turn = True
-        st.session_state.move_count = 0
+        reset_game()
         st.rerun()
 else:
     # Enhanced visual turn indicator
@@ -123,17 +271,10 @@ else:
         st.progress(1.0, text="Black to move")
 
     if game_mode == "Human vs AI (Extremely Difficult)" and board.turn == chess.BLACK:
-        stockfish = get_stockfish()
-        stockfish.set_fen_position(board.fen())
-        best_move = stockfish.get_best_move()
-        if best_move:
-            move = chess.Move.from_uci(best_move)
-            if move in board.legal_moves:
-                board.push(move)
-                st.session_state.board = board
-                st.rerun()
-            else:
-                st.error("Invalid AI move!")
+        if st.session_state.get("ai_future") is None:
+            # A failed search is retried on the next full rerun, i.e. the next user interaction
+            st.session_state.ai_fen = None
+        ai_move_fragment()
     else:
         st.markdown("#### 🎯 Enter Your Move")
         col1, col2 = st.columns([3, 1])
@@ -144,30 +285,28 @@ else:
         
         if move_input:
             try:
-                move = chess.Move.from_uci(move_input)
-                if move in board.legal_moves:
-                    board.push(move)
-                    st.session_state.board = board
-                    st.session_state.player_turn = not st.session_state.player_turn
-                    st.session_state.move_count += 1
-                    st.rerun()
-                else:
-                    st.error("❌ Illegal move! Please try again.")
+                move = parse_move(board, move_input)
+            except chess.IllegalMoveError:
+                st.error("❌ Illegal move! Please try again.")
             except ValueError:
                 st.error("❌ Invalid move format! Use format like 'e2e4'.")
+            else:
+                push_move(board, move)
+                st.session_state.board = board
+                st.session_state.player_turn = not st.session_state.player_turn
+                st.session_state.move_count += 1
+                st.rerun()
         
         # Show legal moves hint
         with st.expander("💡 Show Legal Moves"):
-            legal_moves_list = [str(move) for move in board.legal_moves]
-            st.write(", ".join(legal_moves_list[:20]))  # Show first 20 moves
-            if len(legal_moves_list) > 20:
-                st.write(f"... and {len(legal_moves_list) - 20} more moves")
+            legal_moves_dict = _build_legal_moves_dict(board.fen())
+            st.text("\n".join(f"{square}: {', '.join(targets)}" for square, targets in legal_moves_dict.items()))
 
 col1, col2 = st.columns(2)
 with col1:
     if st.button("↶ Undo Last Move", use_container_width=True):
         if board.move_stack:
-            board.pop()
+            pop_move(board)
             st.session_state.board = board
             st.session_state.player_turn = not st.session_state.player_turn
             st.rerun()
@@ -176,22 +315,13 @@ with col1:
 
 with col2:
     if st.button("🔄 Reset Game", use_container_width=True):
-        st.session_state.board = chess.Board()
-        st.session_state.player_turn = True
-        st.session_state.move_count = 0
+        reset_game()
         st.rerun()
 
 st.markdown("---")
 st.subheader("📜 Move History")
-moves = [str(move) for move in board.move_stack]
-if moves:
-    # Display moves in a more readable format (pairs for White and Black)
-    move_pairs = []
-    for i in range(0, len(moves), 2):
-        if i + 1 < len(moves):
-            move_pairs.append(f"{i//2 + 1}. {moves[i]} {moves[i+1]}")
-        else:
-            move_pairs.append(f"{i//2 + 1}. {moves[i]}")
-    st.text("\n".join(move_pairs))
+if st.session_state.history:
+    # Moves are kept in a readable format (pairs for White and Black) as they are played
+    st.text("\n".join(st.session_state.history))
 else:
-    st.info("No moves yet. Start playing!")
\ No newline at end of file
+    st.info("No moves yet. Start playing!")